@@ -8,6 +8,7 @@ from .cards import (
     ConditionalGuidedLinearModel,
     ConditionalLinear,
     DiffusionSequential,
+    TeaCacheDiffusionSequential,
 )
 from .fc_resnet import FCResNet
 from .mlp import MLP
@@ -20,6 +21,7 @@ __all__ = (
     "ConditionalGuidedLinearModel",
     "ConditionalGuidedConvModel",
     "DiffusionSequential",
+    "TeaCacheDiffusionSequential",
     # Fully Connected Residual Network
     "FCResNet",
 )
@@ -3,8 +3,14 @@
 
 """CARDS Model Utilities."""
 
+import weakref
+from collections import OrderedDict
+from collections.abc import Iterable
+from typing import Any
+
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from torch import Tensor
 
 from lightning_uq_box.uq_methods.utils import _get_output_layer_name_and_module
@@ -13,40 +19,156 @@ from lightning_uq_box.uq_methods.utils import _get_output_layer_name_and_module
 class ConditionalLinear(nn.Module):
     """Conditional Linear Layer."""
 
-    def __init__(self, n_inputs: int, n_outputs: int, n_steps: int) -> None:
+    def __init__(
+        self, n_inputs: int, n_outputs: int, n_steps: int, fold_cache_size: int = 0
+    ) -> None:
         """Initialize a new instance of the layer.
 
         Args:
             n_inputs: number of inputs to the layer
             n_outputs: number of outputs from the layer
             n_steps: number of diffusion steps in embedding
+            fold_cache_size: number of time steps for which the linear weights
+                with the folded in embedding are cached during inference, zero
+                disables folding. Folding only pays off if the cache holds all
+                ``n_steps``, so that repeated sampling loops hit the cache
 
         """
         super().__init__()
         self.n_outputs = n_outputs
         self.lin = nn.Linear(n_inputs, n_outputs)
-        self.embed = nn.Embedding(n_steps, n_outputs)
-        self.embed.weight.data.uniform_()
+        # plain parameter instead of nn.Embedding to avoid its per call overhead
+        self.gamma_table = nn.Parameter(torch.empty(n_steps, n_outputs).uniform_())
+        # optional shift added after the embedding scale, set by folding a
+        # following normalization layer into this layer
+        self.register_buffer("shift", None)
+
+        self.fold_cache_size = fold_cache_size
+        self._fold_cache: OrderedDict[tuple, tuple[Tensor, Tensor]] = OrderedDict()
 
     def forward(self, x: Tensor, t: Tensor) -> Tensor:
         """Forward pass of conditional linear layer.
 
         Args:
             x: input of shape [N, n_inputs]
-            t: input of shape [1]
+            t: input of shape [1] or [N], the embedding broadcasts over the batch
 
         Returns:
             output from condtitional linear model of shape [N, n_outputs]
         """
-        out = self.lin(x)
-        gamma = self.embed(t)
-        out = gamma.view(-1, self.n_outputs) * out
+        # without gradients and a single time step for the whole batch, the
+        # embedding can be folded into the weights to compute a single GEMM,
+        # not while compiling as it would specialize the graph on the time step
+        if (
+            self.fold_cache_size > 0
+            and not torch.is_grad_enabled()
+            and not torch.compiler.is_compiling()
+            and (t.numel() == 1 or bool((t == t.flatten()[0]).all()))
+        ):
+            weight, bias = self._folded_weights(int(t.flatten()[0]))
+            return F.linear(x, weight, bias)
+
+        out = self.embed(t) * self.lin(x)
+        if self.shift is not None:
+            out = out + self.shift
         return out
 
+    def embed(self, t: Tensor) -> Tensor:
+        """Look up the embedding of the time steps.
+
+        Args:
+            t: time steps of shape [N] or [1]
+
+        Returns:
+            embedding of shape [N, n_outputs] or [1, n_outputs]
+        """
+        return self.gamma_table.index_select(0, t.reshape(-1))
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs) -> None:
+        """Load checkpoints saved when the embedding was an nn.Embedding."""
+        old_key = prefix + "embed.weight"
+        if old_key in state_dict:
+            state_dict[prefix + "gamma_table"] = state_dict.pop(old_key)
+        super()._load_from_state_dict(state_dict, prefix, *args, **kwargs)
+
+    def _folded_weights(self, t: int) -> tuple[Tensor, Tensor]:
+        """Compute the linear weights scaled by the embedding of time step t.
+
+        Args:
+            t: time step
+
+        Returns:
+            weight and bias of the folded linear layer
+        """
+        # invalidate on parameter updates or device moves
+        tensors = (self.lin.weight, self.lin.bias, self.gamma_table, self.shift)
+        key = (t,) + tuple((p.data_ptr(), p._version) for p in tensors if p is not None)
+        if key in self._fold_cache:
+            self._fold_cache.move_to_end(key)
+            return self._fold_cache[key]
+
+        gamma = self.gamma_table[t]
+        bias = self.lin.bias * gamma
+        if self.shift is not None:
+            bias = bias + self.shift
+        folded = (self.lin.weight * gamma.unsqueeze(1), bias)
+        self._fold_cache[key] = folded
+        if len(self._fold_cache) > self.fold_cache_size:
+            self._fold_cache.popitem(last=False)
+        return folded
+
 
 class DiffusionSequential(nn.Sequential):
     """My Sequential to accept multiple inputs."""
 
+    def __init__(
+        self, *args: nn.Module, autocast_dtype: torch.dtype | None = None
+    ) -> None:
+        """Initialize a new instance of the Diffusion Sequential.
+
+        Args:
+            *args: modules of the sequential
+            autocast_dtype: if given, run all but the last module under
+                :class:`torch.autocast` with this dtype, the last module is
+                computed in the precision of the input
+        """
+        super().__init__(*args)
+        self.autocast_dtype = autocast_dtype
+        self._update_plan()
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        """Set attribute and update the forward plan if a module is replaced."""
+        super().__setattr__(name, value)
+        if isinstance(value, nn.Module):
+            self._update_plan()
+
+    def __delattr__(self, name: str) -> None:
+        """Delete attribute and update the forward plan."""
+        super().__delattr__(name)
+        self._update_plan()
+
+    def add_module(self, name: str, module: nn.Module | None) -> None:
+        """Add a child module and update the forward plan."""
+        super().add_module(name, module)
+        self._update_plan()
+
+    def insert(self, index: int, module: nn.Module) -> "DiffusionSequential":
+        """Insert a module at the given index and update the forward plan."""
+        super().insert(index, module)
+        self._update_plan()
+        return self
+
+    def _update_plan(self) -> None:
+        """Precompute which modules take the time step as input.
+
+        This keeps the ``isinstance`` checks out of the forward pass, which is
+        called once per diffusion step.
+        """
+        self._plan: tuple[tuple[nn.Module, bool], ...] = tuple(
+            (module, isinstance(module, ConditionalLinear))
+            for module in self._modules.values()
+        )
+
     def forward(self, input: Tensor, t: Tensor):
         """Forward pass.
 
@@ -57,14 +179,146 @@ class DiffusionSequential(nn.Sequential):
         Returns:
             output of diffusion model [n, output_dim]
         """
-        for module in self._modules.values():
-            if isinstance(module, ConditionalLinear):
-                input = module(input, t)
-            else:
-                input = module(input)
+        if self.autocast_dtype is None:
+            return self._forward_modules(self._plan, input, t)
+
+        with self._autocast(input):
+            hidden = self._forward_modules(self._plan[:-1], input, t)
+        return self._plan[-1][0](hidden.to(input.dtype))
+
+    def _autocast(self, input: Tensor) -> torch.autocast:
+        """Autocast context for the hidden modules.
+
+        Args:
+            input: input tensor to the model
+
+        Returns:
+            autocast context
+        """
+        return torch.autocast(device_type=input.device.type, dtype=self.autocast_dtype)
+
+    def _forward_modules(
+        self, plan: Iterable[tuple[nn.Module, bool]], input: Tensor, t: Tensor
+    ) -> Tensor:
+        """Pass the input through a sequence of modules.
+
+        Args:
+            plan: modules to apply in order, together with whether they take
+                the time step as input
+            input: input tensor to the first module
+            t: time steps shape [1]
+
+        Returns:
+            output of the last module
+        """
+        for module, needs_t in plan:
+            input = module(input, t) if needs_t else module(input)
         return input
 
 
+class TeaCacheDiffusionSequential(DiffusionSequential):
+    """Diffusion Sequential with a timestep aware residual cache.
+
+    During sampling, the hidden layers are skipped whenever the modulated input
+    of the first conditional linear layer has changed little since the last full
+    forward pass, and a cached residual is reused instead. The first and last
+    diffusion time steps are always computed fully.
+
+    If you use this in your research, please cite the following paper:
+
+    * https://arxiv.org/abs/2411.19108
+    """
+
+    def __init__(
+        self,
+        *args: nn.Module,
+        threshold: float = 0.1,
+        autocast_dtype: torch.dtype | None = None,
+    ) -> None:
+        """Initialize a new instance of the Tea Cache Diffusion Sequential.
+
+        Args:
+            *args: modules of the sequential, the first module has to be a
+                :class:`ConditionalLinear` layer and the last one the output layer
+            threshold: threshold on the accumulated relative L1 distance of the
+                modulated input below which the cached residual is reused
+            autocast_dtype: if given, run all but the last module under
+                :class:`torch.autocast` with this dtype
+        """
+        super().__init__(*args, autocast_dtype=autocast_dtype)
+        assert isinstance(
+            self[0], ConditionalLinear
+        ), "First module has to be a ConditionalLinear layer"
+        self.threshold = threshold
+        self.reset_cache()
+
+    def reset_cache(self) -> None:
+        """Reset the cached modulated input and residual."""
+        self.prev_modulated_input: Tensor | None = None
+        self.accumulated_rel_l1 = 0.0
+        self.cached_residual: Tensor | None = None
+
+    def forward(self, input: Tensor, t: Tensor):
+        """Forward pass.
+
+        Args:
+            input: input tensor to model shape [n, feature_dim]
+            t: time steps shape [1]
+
+        Returns:
+            output of diffusion model [n, output_dim]
+        """
+        # the cache assumes a single time step that changes slowly across calls,
+        # as in the sampling loop, not per sample time steps as in training or
+        # validation
+        if self.training or not (t.numel() == 1 or bool((t == t.flatten()[0]).all())):
+            self.reset_cache()
+            return super().forward(input, t)
+
+        if self.autocast_dtype is None:
+            hidden = self._forward_cached(input, t)
+        else:
+            with self._autocast(input):
+                hidden = self._forward_cached(input, t)
+        return self._plan[-1][0](hidden.to(input.dtype))
+
+    def _forward_cached(self, input: Tensor, t: Tensor):
+        """Compute the hidden features, reusing the cached residual if possible.
+
+        Args:
+            input: input tensor to model shape [n, feature_dim]
+            t: time steps shape [1]
+
+        Returns:
+            input features of the output layer
+        """
+        modulated_input = self._plan[0][0](input, t)
+
+        n_steps = self[0].gamma_table.shape[0]
+        is_boundary = t.max() >= n_steps - 1 or t.min() <= 0
+        should_calc = True
+        if (
+            not is_boundary
+            and self.cached_residual is not None
+            and self.prev_modulated_input.shape == modulated_input.shape
+        ):
+            self.accumulated_rel_l1 += (
+                (modulated_input - self.prev_modulated_input).abs().mean()
+                / self.prev_modulated_input.abs().mean()
+            ).item()
+            should_calc = self.accumulated_rel_l1 >= self.threshold
+        self.prev_modulated_input = modulated_input
+
+        if should_calc:
+            self.accumulated_rel_l1 = 0.0
+            hidden = self._forward_modules(self._plan[1:-1], modulated_input, t)
+            self.cached_residual = hidden - modulated_input
+        else:
+            hidden = modulated_input + self.cached_residual
+
+        return hidden
+
+
 class ConditionalGuidedLinearModel(nn.Module):
     """Conditional Guided Model."""
 
@@ -77,6 +331,9 @@ class ConditionalGuidedLinearModel(nn.Module):
         cat_x: bool = False,
         cat_y_pred: bool = False,
         activation_fn: nn.Module | None = None,
+        compile: bool = False,
+        tea_cache_threshold: float = 0.0,
+        autocast_dtype: torch.dtype | None = None,
     ) -> None:
         """Initialize a new instance of Conditional Guided Model.
 
@@ -91,6 +348,15 @@ class ConditionalGuidedLinearModel(nn.Module):
             cat_y_pred: whether to condition on the y_0_hat prediction
                 of the conditional mean model by concatenation
             activation_fn: activation function between conditional linear layers
+            compile: whether to compile the conditional linear layers with
+                :func:`torch.compile` to fuse their kernels
+            tea_cache_threshold: if larger than zero, reuse the cached residual of
+                the hidden layers during sampling while the accumulated relative
+                change of the modulated input stays below this threshold,
+                see :class:`TeaCacheDiffusionSequential`
+            autocast_dtype: if given, e.g. ``torch.bfloat16``, the conditional
+                linear layers run under :class:`torch.autocast` with this dtype,
+                while the final output layer is kept in full precision
         """
         super().__init__()
 
@@ -117,7 +383,23 @@ class ConditionalGuidedLinearModel(nn.Module):
         # final output layer is standard layer
         # layers += [nn.Linear(layer_sizes[-1], n_outputs)]
         layers += [nn.Linear(layer_sizes[-1], y_dim)]
-        self.model = DiffusionSequential(*layers)
+        if tea_cache_threshold > 0:
+            assert n_hidden[0] == n_hidden[-1], (
+                "First and last hidden layer need to have the same size "
+                "to cache their residual"
+            )
+            self.model = TeaCacheDiffusionSequential(
+                *layers, threshold=tea_cache_threshold, autocast_dtype=autocast_dtype
+            )
+        else:
+            self.model = DiffusionSequential(*layers, autocast_dtype=autocast_dtype)
+
+        # reused output of the input concatenation during sampling
+        self.register_buffer("_cat_buf", torch.empty(0), persistent=False)
+        if compile:
+            # compile in place instead of wrapping the module, to keep the state
+            # dict keys unchanged
+            self.model.compile(mode="reduce-overhead")
 
     def forward(self, x: Tensor, y_t: Tensor, y_0_hat: Tensor, t: Tensor) -> Tensor:
         """Forward pass of the Conditional Guided Model.
@@ -130,22 +412,53 @@ class ConditionalGuidedLinearModel(nn.Module):
         """
         if self.cat_x:
             if self.cat_y_pred:
-                eps_pred = torch.cat((y_t, y_0_hat, x), dim=1)
+                eps_pred = self._cat((y_t, y_0_hat, x))
             else:
-                eps_pred = torch.cat((y_t, x), dim=1)
+                eps_pred = self._cat((y_t, x))
         else:
             if self.cat_y_pred:
-                eps_pred = torch.cat((y_t, y_0_hat), dim=1)
+                eps_pred = self._cat((y_t, y_0_hat))
             else:
                 eps_pred = y_t
         return self.model(eps_pred, t)
 
+    def _cat(self, tensors: tuple[Tensor, ...]) -> Tensor:
+        """Concatenate the inputs along the feature dimension.
+
+        Without gradient tracking, the concatenation is written into a persistent
+        buffer to avoid a new allocation at every diffusion step.
+
+        Args:
+            tensors: tensors of shape [N, dim_i] to concatenate
+
+        Returns:
+            concatenated tensor of shape [N, sum(dim_i)]
+        """
+        if torch.is_grad_enabled():
+            return torch.cat(tensors, dim=1)
+
+        shape = (tensors[0].shape[0], sum(tensor.shape[1] for tensor in tensors))
+        if (
+            self._cat_buf.shape != shape
+            or self._cat_buf.dtype != tensors[0].dtype
+            or self._cat_buf.device != tensors[0].device
+            # inference tensors cannot be updated outside of inference mode
+            or self._cat_buf.is_inference() != torch.is_inference_mode_enabled()
+        ):
+            self._cat_buf = torch.empty(
+                shape, dtype=tensors[0].dtype, device=tensors[0].device
+            )
+        return torch.cat(tensors, dim=1, out=self._cat_buf)
+
 
 class ConditionalGuidedConvModel(nn.Module):
     """Conditional Guidance Model for Image tasks."""
 
     def __init__(
-        self, encoder: nn.Module, cond_guide_model: ConditionalGuidedLinearModel
+        self,
+        encoder: nn.Module,
+        cond_guide_model: ConditionalGuidedLinearModel,
+        compile: bool = False,
     ) -> None:
         """Initialize a new instance of Conditional Guided Conv Model.
 
@@ -153,7 +466,8 @@ class ConditionalGuidedConvModel(nn.Module):
             encoder: encoder model acting like a feature extractor before
                 a conditional linear guidance model
             cond_guide_model: conditional
-            n_steps: number of diffusion steps
+            compile: whether to compile the forward pass with
+                :func:`torch.compile` to fuse the kernels of the guidance stages
 
         Raises:
             Assertionerror for misconfigurations between encoder
@@ -188,6 +502,85 @@ class ConditionalGuidedConvModel(nn.Module):
             nn.Softplus(),
         )
 
+        # encoded input of the last forward pass without gradients, the input
+        # image does not change across the steps of a diffusion sampling loop
+        self._enc_cache: tuple[weakref.ref, tuple, Tensor] | None = None
+
+        if compile:
+            # compile in place instead of wrapping the module, to keep the state
+            # dict keys unchanged, batch sizes vary so let dynamo decide on
+            # dynamic shapes
+            self.compile(mode="reduce-overhead", dynamic=None)
+
+    @torch.no_grad()
+    def fuse_bn_for_inference(self) -> None:
+        """Fold the batch norm of the connection module into its linear layer.
+
+        In eval mode the batch norm is a fixed affine transformation. Its scale is
+        folded into the time step embedding and its shift is added after the
+        embedding scale, so the batch norm can be replaced by an identity. This
+        modifies the model in place and is meant for inference only.
+
+        Raises:
+            AssertionError if the model is in training mode
+        """
+        assert not self.training, "Batch norm can only be fused in eval mode"
+        cond_linear, bn = self.connect_module[0], self.connect_module[1]
+        if not isinstance(bn, nn.BatchNorm1d) or not bn.track_running_stats:
+            return
+
+        scale = torch.rsqrt(bn.running_var + bn.eps)
+        shift = -bn.running_mean * scale
+        if bn.affine:
+            scale = scale * bn.weight
+            shift = shift * bn.weight + bn.bias
+
+        # BN(gamma * lin(x)) = (gamma * scale) * lin(x) + shift
+        cond_linear.gamma_table.mul_(scale)
+        if cond_linear.shift is None:
+            cond_linear.shift = shift
+        else:
+            cond_linear.shift = cond_linear.shift * scale + shift
+        self.connect_module[1] = nn.Identity()
+
+    def reset_encoder_cache(self) -> None:
+        """Reset the cached encoding of the input."""
+        self._enc_cache = None
+
+    def encode(self, x: Tensor) -> Tensor:
+        """Encode the input, reusing the cached encoding without gradients.
+
+        Args:
+            x: input data
+
+        Returns:
+            normalized encoder features
+        """
+        if torch.is_grad_enabled():
+            self.reset_encoder_cache()
+            return self.norm(self.encoder(x))
+
+        # invalidate on input or parameter updates, device moves and mode changes,
+        # inference tensors cannot be modified in place, so they have no version
+        tensors = (
+            x,
+            *self.encoder.parameters(),
+            *self.encoder.buffers(),
+            *self.norm.parameters(),
+            *self.norm.buffers(),
+        )
+        key = (self.training,) + tuple(
+            (p.data_ptr(), None if p.is_inference() else p._version) for p in tensors
+        )
+        if (
+            self._enc_cache is None
+            or self._enc_cache[0]() is not x
+            or self._enc_cache[1] != key
+        ):
+            # only keep a weak reference to the input to not keep it alive
+            self._enc_cache = (weakref.ref(x), key, self.norm(self.encoder(x)))
+        return self._enc_cache[2]
+
     def forward(self, x: Tensor, y_t: Tensor, y_0_hat: Tensor, t: Tensor) -> Tensor:
         """Forward pass of the Conditional Guided Conv Model.
 
@@ -201,8 +594,7 @@ class ConditionalGuidedConvModel(nn.Module):
             output of the conditional guided convolutional model
         """
         # encoding
-        x = self.encoder(x)
-        x = self.norm(x)
+        x = self.encode(x)
 
         x = self.connect_module(x, t)
 
@@ -115,8 +115,8 @@ class CARDBase(BaseModule):
         y_t_sample = self.q_sample(
             y,
             y_0_hat,
-            self.noise_scheduler.alphas_bar_sqrt.to(self.device),
-            self.noise_scheduler.one_minus_alphas_bar_sqrt.to(self.device),
+            self.noise_scheduler.alphas_bar_sqrt,
+            self.noise_scheduler.one_minus_alphas_bar_sqrt,
             ant_samples_t,
             noise=e,
         )
@@ -220,8 +220,8 @@ class CARDBase(BaseModule):
                     y_0_hat_tile,
                     y_0_hat_tile,
                     self.n_steps,
-                    self.noise_scheduler.alphas.to(self.device),
-                    self.noise_scheduler.one_minus_alphas_bar_sqrt.to(self.device),
+                    self.noise_scheduler.alphas,
+                    self.noise_scheduler.one_minus_alphas_bar_sqrt,
                 )
 
                 # put in shape [n_z_samples, batch_size, output_dimension]
@@ -240,8 +240,8 @@ class CARDBase(BaseModule):
                         y_0_hat,
                         y_0_hat,
                         self.n_steps,
-                        self.noise_scheduler.alphas.to(self.device),
-                        self.noise_scheduler.one_minus_alphas_bar_sqrt.to(self.device),
+                        self.noise_scheduler.alphas,
+                        self.noise_scheduler.one_minus_alphas_bar_sqrt,
                     )[-1]
                     for i in range(self.n_z_samples)
                 ]
@@ -281,7 +281,7 @@ class CARDBase(BaseModule):
             reverse process sample
         """
         z = torch.randn_like(y)  # if t > 1 else torch.zeros_like(y)
-        t = torch.tensor([t]).to(self.device)
+        t = torch.tensor([t], device=self.device)
         alpha_t = self.extract(alphas, t, y)
         sqrt_one_minus_alpha_bar_t = self.extract(one_minus_alphas_bar_sqrt, t, y)
         sqrt_one_minus_alpha_bar_t_m_1 = self.extract(
@@ -348,7 +348,7 @@ class CARDBase(BaseModule):
             y_0 sample
         """
         # corresponding to timestep 1 (i.e., t=1 in diffusion models)
-        t = torch.tensor([0]).to(self.device)
+        t = torch.tensor([0], device=self.device)
         sqrt_one_minus_alpha_bar_t = self.extract(one_minus_alphas_bar_sqrt, t, y)
         sqrt_alpha_bar_t = (1 - sqrt_one_minus_alpha_bar_t.square()).sqrt()
         eps_theta = self.guidance_model(x, y, y_0_hat, t).detach()
@@ -465,7 +465,7 @@ class CARDBase(BaseModule):
         )
         return y_t
 
-    def extract(self, input: Tensor, t: int, x: Tensor) -> Tensor:
+    def extract(self, input: Tensor, t: Tensor, x: Tensor) -> Tensor:
         """Extract noise level at time step t from schedule.
 
         Args:
@@ -476,10 +476,7 @@ class CARDBase(BaseModule):
         Returns:
             noisy version of x
         """
-        shape = x.shape
-        out = torch.gather(input, 0, t)
-        reshape = [t.shape[0]] + [1] * (len(shape) - 1)
-        return out.reshape(*reshape)
+        return NoiseScheduler.get_noisy_x_at_t(input, t, x)
 
     def test_step(
         self, batch: dict[str, Tensor], batch_idx: int, dataloader_idx: int = 0
@@ -696,8 +693,12 @@ class CARDClassification(CARDBase):
         )
 
 
-class NoiseScheduler:
-    """Noise Scheduler for Diffusion Training."""
+class NoiseScheduler(nn.Module):
+    """Noise Scheduler for Diffusion Training.
+
+    The schedule tensors are registered as non-persistent buffers, so that they
+    move along with the module that owns the scheduler on ``.to(device)``.
+    """
 
     valid_schedules = [
         "linear",
@@ -715,6 +716,8 @@ class NoiseScheduler:
         n_steps: int = 1000,
         beta_start: float = 1e-5,
         beta_end: float = 1e-2,
+        device: torch.device | str | None = None,
+        dtype: torch.dtype = torch.float32,
     ) -> None:
         """Initialize a new instance of the noise scheduler.
 
@@ -723,108 +726,131 @@ class NoiseScheduler:
             n_steps: number of diffusion time steps
             beta_start: beta noise start value
             beta_end: beta noise end value
+            device: device on which to create the schedule tensors
+            dtype: data type of the schedule tensors
         Raises:
             AssertionError if schedule is invalid
         """
         assert (
             schedule in self.valid_schedules
         ), f"Invalid schedule, please choose one of {self.valid_schedules}."
+        super().__init__()
         self.schedule = schedule
         self.n_steps = n_steps
         self.beta_start = beta_start
         self.beta_end = beta_end
+        self.factory_kwargs = {"device": device, "dtype": dtype}
+
+        # only build the selected schedule
+        betas = {
+            "linear": self.linear_schedule,
+            "const": self.constant_schedule,
+            "quad": self.quadratic_schedule,
+            "sigmoid": self.sigmoid_schedule,
+            "cosine": self.cosine_schedule,
+            "cosine_anneal": self.cosine_anneal_schedule,
+        }[schedule]()
+        alphas = 1.0 - betas
+        # prod(1 - beta) = exp(sum(log(1 - beta))), valid since all betas are < 1,
+        # cumsum has a cheaper backward than cumprod and is torch.compile friendly
+        alphas_cumprod = torch.exp(torch.cumsum(torch.log1p(-betas), dim=0))
+
+        self.register_buffer("betas", betas, persistent=False)
+        self.register_buffer("betas_sqrt", torch.sqrt(betas), persistent=False)
+        self.register_buffer("alphas", alphas, persistent=False)
+        self.register_buffer("alphas_cumprod", alphas_cumprod, persistent=False)
+        self.register_buffer(
+            "alphas_bar_sqrt", torch.sqrt(alphas_cumprod), persistent=False
+        )
+        self.register_buffer(
+            "one_minus_alphas_bar_sqrt",
+            torch.sqrt(1 - alphas_cumprod),
+            persistent=False,
+        )
 
-        self.betas = {
-            "linear": self.linear_schedule(),
-            "const": self.constant_schedule(),
-            "quad": self.quadratic_schedule(),
-            "sigmoid": self.sigmoid_schedule(),
-            "cosine": self.cosine_schedule(),
-            "cosine_anneal": self.cosine_anneal_schedule(),
-        }[schedule]
-
-        self.betas_sqrt = torch.sqrt(self.betas)
-        self.alphas = 1.0 - self.betas
-        self.alphas_cumprod = self.alphas.cumprod(dim=0)
-        self.alphas_bar_sqrt = torch.sqrt(self.alphas_cumprod)
-        self.one_minus_alphas_bar_sqrt = torch.sqrt(1 - self.alphas_cumprod)
+    def _apply(self, fn: Any, recurse: bool = True) -> "NoiseScheduler":
+        """Apply fn to the schedule buffers, keeping their dtype.
+
+        The schedule follows device moves of the owning module, but not dtype
+        casts such as ``.to(torch.bfloat16)``, because low precision would
+        collapse small betas and break the reverse process.
+        """
+        buffers = dict(self._buffers)
+        super()._apply(fn, recurse)
+        for name, buffer in buffers.items():
+            new_buffer = self._buffers[name]
+            if buffer is not None and new_buffer.dtype != buffer.dtype:
+                self._buffers[name] = buffer.to(new_buffer.device)
+        return self
 
     def linear_schedule(self) -> Tensor:
         """Linear Schedule."""
-        return torch.linspace(self.beta_start, self.beta_end, self.n_steps)
+        return torch.linspace(
+            self.beta_start, self.beta_end, self.n_steps, **self.factory_kwargs
+        )
 
     def constant_schedule(self) -> Tensor:
         """Constant Schedule."""
-        return self.beta_end * torch.ones(self.n_steps)
+        return self.beta_end * torch.ones(self.n_steps, **self.factory_kwargs)
 
     def quadratic_schedule(self) -> Tensor:
         """Quadratic Schedule."""
         return (
-            torch.linspace(self.beta_start**0.5, self.beta_end**0.5, self.n_steps) ** 2
+            torch.linspace(
+                self.beta_start**0.5,
+                self.beta_end**0.5,
+                self.n_steps,
+                **self.factory_kwargs,
+            )
+            ** 2
         )
 
     def sigmoid_schedule(self) -> Tensor:
         """Sigmoid Schedule."""
         betas = (
-            torch.sigmoid(torch.linspace(-6, 6, self.n_steps))
+            torch.sigmoid(torch.linspace(-6, 6, self.n_steps, **self.factory_kwargs))
             * (self.beta_end - self.beta_start)
             + self.beta_start
         )
-        return torch.sigmoid(betas)
+        return betas
 
     def cosine_schedule(self) -> Tensor:
         """Cosine Schedule."""
         max_beta = 0.999
         cosine_s = 0.008
-        return torch.tensor(
-            [
-                min(
-                    1
-                    - (
-                        math.cos(
-                            ((i + 1) / self.n_steps + cosine_s)
-                            / (1 + cosine_s)
-                            * math.pi
-                            / 2
-                        )
-                        ** 2
-                    )
-                    / (
-                        math.cos(
-                            (i / self.n_steps + cosine_s) / (1 + cosine_s) * math.pi / 2
-                        )
-                        ** 2
-                    ),
-                    max_beta,
-                )
-                for i in range(self.n_steps)
-            ]
+        i = torch.arange(
+            self.n_steps + 1, device=self.factory_kwargs["device"], dtype=torch.float64
         )
+        # the numerator at step i is the denominator at step i + 1
+        alphas_bar = torch.cos(
+            (i / self.n_steps + cosine_s) / (1 + cosine_s) * math.pi / 2
+        ).pow(2)
+        betas = 1 - alphas_bar[1:] / alphas_bar[:-1]
+        return betas.clamp(max=max_beta).to(self.factory_kwargs["dtype"])
 
     def cosine_anneal_schedule(self) -> Tensor:
         """Cosine Annealing Schedule."""
-        return torch.tensor(
-            [
-                self.beta_start
-                + 0.5
-                * (self.beta_end - self.beta_start)
-                * (1 - math.cos(t / (self.n_steps - 1) * math.pi))
-                for t in range(self.n_steps)
-            ]
+        t = torch.arange(self.n_steps, **self.factory_kwargs)
+        return self.beta_start + 0.5 * (self.beta_end - self.beta_start) * (
+            1 - torch.cos(t / (self.n_steps - 1) * math.pi)
         )
 
-    def get_noisy_x_at_t(input, t, x) -> Tensor:
-        """Retrieve a noisy representation at time step t.
+    @staticmethod
+    def get_noisy_x_at_t(schedule: Tensor, t: Tensor, x: Tensor) -> Tensor:
+        """Retrieve the schedule values at time step t.
 
         Args:
-            input: schedule version
-            t: time step
-            x: tensor ot make noisy version of
+            schedule: schedule version
+            t: time steps of shape [N], on the same device as the schedule
+            x: tensor to make noisy version of
 
         Returns:
-            A noisy
+            schedule values at t of shape [N, 1, ...], broadcastable to x
+
+        Raises:
+            AssertionError if schedule and t are on different devices
         """
-        shape = x.shape
-        out = torch.gather(input, 0, t.to(input.device))
-        reshape = [t.shape[0]] + [1] * (len(shape) - 1)
-        return out.reshape(*reshape)
+        assert (
+            schedule.device == t.device
+        ), "Schedule and time steps have to be on the same device"
+        return torch.gather(schedule, 0, t).view(t.shape[0], *([1] * (x.dim() - 1)))
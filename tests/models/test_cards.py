@@ -0,0 +1,351 @@
+# Copyright (c) 2023 lightning-uq-box. All rights reserved.
+# Licensed under the Apache License 2.0.
+
+"""Tests for CARD models."""
+
+import copy
+
+import pytest
+import torch
+import torch.nn as nn
+
+from lightning_uq_box.models import (
+    ConditionalGuidedConvModel,
+    ConditionalGuidedLinearModel,
+    ConditionalLinear,
+    DiffusionSequential,
+    TeaCacheDiffusionSequential,
+)
+
+
+@pytest.fixture
+def inputs() -> tuple[torch.Tensor, ...]:
+    x = torch.randn(8, 3)
+    y_t = torch.randn(8, 2)
+    y_0_hat = torch.randn(8, 2)
+    return x, y_t, y_0_hat
+
+
+class TestConditionalLinear:
+    def test_folded_forward(self) -> None:
+        layer = ConditionalLinear(3, 5, n_steps=10, fold_cache_size=2)
+        x = torch.randn(8, 3)
+        t = torch.tensor([4])
+        expected = layer(x, t)
+        with torch.no_grad():
+            torch.testing.assert_close(layer(x, t), expected)
+            torch.testing.assert_close(layer(x, t.repeat(8)), expected)
+            assert len(layer._fold_cache) == 1
+            for step in range(3):
+                layer(x, torch.tensor([step]))
+            assert len(layer._fold_cache) == 2
+
+            # cache is invalidated by parameter updates
+            layer.lin.weight.add_(1.0)
+            expected = layer.embed(t) * layer.lin(x)
+            torch.testing.assert_close(layer(x, t), expected)
+
+    def test_no_folding_by_default(self) -> None:
+        layer = ConditionalLinear(3, 5, n_steps=10)
+        with torch.no_grad():
+            layer(torch.randn(8, 3), torch.tensor([4]))
+        assert len(layer._fold_cache) == 0
+
+    @pytest.mark.parametrize("t_shape", [(), (1,), (8,)])
+    def test_forward_broadcast(self, t_shape: tuple[int, ...]) -> None:
+        layer = ConditionalLinear(3, 5, n_steps=10)
+        out = layer(torch.randn(8, 3), torch.randint(0, 10, t_shape))
+        assert out.shape == (8, 5)
+
+    def test_load_embedding_state_dict(self) -> None:
+        layer = ConditionalLinear(3, 5, n_steps=10)
+        embedding = torch.randn(10, 5)
+        state_dict = {
+            "lin.weight": torch.randn(5, 3),
+            "lin.bias": torch.randn(5),
+            "embed.weight": embedding,
+        }
+        layer.load_state_dict(state_dict)
+        torch.testing.assert_close(layer.gamma_table.data, embedding)
+
+
+class TestDiffusionSequential:
+    def test_plan_follows_modules(self) -> None:
+        model = DiffusionSequential(ConditionalLinear(3, 4, n_steps=10), nn.Softplus())
+        x = torch.randn(8, 3)
+        t = torch.tensor([2])
+        assert [needs_t for _, needs_t in model._plan] == [True, False]
+
+        model.append(nn.Linear(4, 2))
+        assert model(x, t).shape == (8, 2)
+        model[1] = nn.Identity()
+        model.insert(2, ConditionalLinear(4, 4, n_steps=10))
+        del model[0]
+        assert [type(module) for module, _ in model._plan] == [
+            nn.Identity,
+            ConditionalLinear,
+            nn.Linear,
+        ]
+        assert [needs_t for _, needs_t in model._plan] == [False, True, False]
+
+
+class TestConditionalGuidedLinearModel:
+    @pytest.mark.parametrize("cat_x", [True, False])
+    @pytest.mark.parametrize("cat_y_pred", [True, False])
+    def test_forward(self, inputs, cat_x: bool, cat_y_pred: bool) -> None:
+        model = ConditionalGuidedLinearModel(
+            n_steps=10, x_dim=3, y_dim=2, cat_x=cat_x, cat_y_pred=cat_y_pred
+        )
+        assert isinstance(model.model, DiffusionSequential)
+        out = model(*inputs, t=torch.randint(0, 10, (8,)))
+        assert out.shape == (8, 2)
+        out = model(*inputs, t=torch.tensor([4]))
+        assert out.shape == (8, 2)
+
+    def test_compile(self, inputs) -> None:
+        model = ConditionalGuidedLinearModel(
+            n_steps=10, x_dim=3, y_dim=2, cat_x=True, compile=True
+        )
+        eager = ConditionalGuidedLinearModel(n_steps=10, x_dim=3, y_dim=2, cat_x=True)
+        eager.load_state_dict(model.state_dict())
+        t = torch.randint(0, 10, (8,))
+        expected = eager(*inputs, t=t)
+        torch.testing.assert_close(model(*inputs, t=t), expected)
+
+        # the copy runs with its own weights
+        model_copy = copy.deepcopy(model)
+        with torch.no_grad():
+            model_copy.model[-1].bias.add_(1.0)
+        torch.testing.assert_close(model_copy(*inputs, t=t), expected + 1.0)
+
+    @pytest.mark.parametrize("tea_cache_threshold", [0.0, 0.1])
+    def test_autocast(self, inputs, tea_cache_threshold: float) -> None:
+        model = ConditionalGuidedLinearModel(
+            n_steps=10,
+            x_dim=3,
+            y_dim=2,
+            cat_x=True,
+            tea_cache_threshold=tea_cache_threshold,
+            autocast_dtype=torch.bfloat16,
+        )
+        model.eval()
+        with torch.no_grad():
+            out = model(*inputs, t=torch.tensor([9]))
+            model.model.autocast_dtype = None
+            expected = model(*inputs, t=torch.tensor([9]))
+        assert out.dtype == torch.float32
+        torch.testing.assert_close(out, expected, atol=0.1, rtol=0.1)
+
+    def test_cat_buffer(self, inputs) -> None:
+        model = ConditionalGuidedLinearModel(
+            n_steps=10, x_dim=3, y_dim=2, cat_x=True, cat_y_pred=True
+        )
+        t = torch.tensor([4])
+        expected = model(*inputs, t=t)
+        assert model._cat_buf.numel() == 0
+        with torch.no_grad():
+            torch.testing.assert_close(model(*inputs, t=t), expected)
+            buffer = model._cat_buf
+            assert buffer.shape == (8, 7)
+            model(*inputs, t=t)
+            assert model._cat_buf is buffer
+
+    def test_cat_buffer_after_inference_mode(self, inputs) -> None:
+        model = ConditionalGuidedLinearModel(
+            n_steps=10, x_dim=3, y_dim=2, cat_x=True, cat_y_pred=True
+        )
+        t = torch.tensor([4])
+        with torch.inference_mode():
+            expected = model(*inputs, t=t)
+            assert model._cat_buf.is_inference()
+        with torch.no_grad():
+            torch.testing.assert_close(model(*inputs, t=t), expected)
+            assert not model._cat_buf.is_inference()
+
+
+class TestTeaCacheDiffusionSequential:
+    def test_no_cache_in_training(self, inputs) -> None:
+        model = ConditionalGuidedLinearModel(
+            n_steps=10, x_dim=3, y_dim=2, cat_x=True, tea_cache_threshold=1e3
+        )
+        assert isinstance(model.model, TeaCacheDiffusionSequential)
+        model(*inputs, t=torch.tensor([5]))
+        assert model.model.cached_residual is None
+
+    def test_reuse_residual(self, inputs) -> None:
+        model = ConditionalGuidedLinearModel(
+            n_steps=10, x_dim=3, y_dim=2, cat_x=True, tea_cache_threshold=1e3
+        )
+        model.eval()
+        with torch.no_grad():
+            model(*inputs, t=torch.tensor([9]))
+            residual = model.model.cached_residual
+            assert residual is not None
+            model(*inputs, t=torch.tensor([8]))
+            # under the threshold the cached residual is reused
+            assert model.model.cached_residual is residual
+            # boundary time steps are always computed
+            model(*inputs, t=torch.tensor([0]))
+            assert model.model.cached_residual is not residual
+
+    def test_no_cache_mixed_time_steps(self, inputs) -> None:
+        model = ConditionalGuidedLinearModel(
+            n_steps=10, x_dim=3, y_dim=2, cat_x=True, tea_cache_threshold=1e3
+        )
+        model.eval()
+        reference = DiffusionSequential(*model.model)
+        t = torch.tensor([5, 5, 5, 5, 6, 6, 6, 6])
+        with torch.no_grad():
+            model(*inputs, t=torch.tensor([9]))
+            model(*inputs, t=torch.tensor([5]))
+            out = model(*inputs, t=t)
+        assert model.model.cached_residual is None
+        torch.testing.assert_close(
+            out, reference(torch.cat((inputs[1], inputs[0]), dim=1), t)
+        )
+
+    def test_zero_threshold_matches_full_forward(self, inputs) -> None:
+        model = ConditionalGuidedLinearModel(
+            n_steps=10, x_dim=3, y_dim=2, cat_x=True, tea_cache_threshold=1e-12
+        )
+        model.eval()
+        reference = DiffusionSequential(*model.model)
+        with torch.no_grad():
+            for step in reversed(range(10)):
+                t = torch.tensor([step])
+                torch.testing.assert_close(
+                    model(*inputs, t=t),
+                    reference(torch.cat((inputs[1], inputs[0]), dim=1), t),
+                )
+
+    def test_outer_autocast(self, inputs) -> None:
+        model = ConditionalGuidedLinearModel(
+            n_steps=10, x_dim=3, y_dim=2, cat_x=True, tea_cache_threshold=1e3
+        )
+        dtypes = []
+        model.model[2].lin.register_forward_hook(
+            lambda module, args, out: dtypes.append(out.dtype)
+        )
+        model.eval()
+        with torch.no_grad(), torch.autocast("cpu", dtype=torch.bfloat16):
+            model(*inputs, t=torch.tensor([9]))
+        assert dtypes == [torch.bfloat16]
+
+    def test_invalid_hidden_sizes(self) -> None:
+        with pytest.raises(AssertionError):
+            ConditionalGuidedLinearModel(
+                n_steps=10, x_dim=3, y_dim=2, n_hidden=[16, 8], tea_cache_threshold=0.1
+            )
+
+
+class TestConditionalGuidedConvModel:
+    @pytest.fixture
+    def model(self) -> ConditionalGuidedConvModel:
+        encoder = nn.Sequential(
+            nn.Conv2d(3, 4, kernel_size=3, padding=1),
+            nn.AdaptiveAvgPool2d(1),
+            nn.Flatten(),
+            nn.Linear(4, 2),
+        )
+        cond_guide_model = ConditionalGuidedLinearModel(
+            n_steps=10, x_dim=2, y_dim=2, cat_y_pred=True
+        )
+        return ConditionalGuidedConvModel(encoder, cond_guide_model)
+
+    def test_encoder_cache(self, model: ConditionalGuidedConvModel) -> None:
+        calls = []
+        model.encoder.register_forward_hook(lambda *args: calls.append(1))
+        x = torch.randn(4, 3, 8, 8)
+        y_t = torch.randn(4, 2)
+
+        model(x, y_t, y_t, torch.randint(0, 10, (4,)))
+        model(x, y_t, y_t, torch.randint(0, 10, (4,)))
+        assert len(calls) == 2
+
+        model.eval()
+        with torch.no_grad():
+            for step in reversed(range(10)):
+                out = model(x, y_t, y_t, torch.tensor([step]))
+                assert out.shape == (4, 2)
+            assert len(calls) == 3
+            model(torch.randn(4, 3, 8, 8), y_t, y_t, torch.tensor([9]))
+            assert len(calls) == 4
+            model.reset_encoder_cache()
+            model(x, y_t, y_t, torch.tensor([9]))
+            assert len(calls) == 5
+
+        # with gradients the encoder always runs, also in eval mode
+        model(x, y_t, y_t, torch.tensor([9]))
+        model(x, y_t, y_t, torch.tensor([8]))
+        assert len(calls) == 7
+
+    def test_encoder_cache_inference_mode(
+        self, model: ConditionalGuidedConvModel
+    ) -> None:
+        calls = []
+        model.encoder.register_forward_hook(lambda *args: calls.append(1))
+        model.eval()
+        with torch.inference_mode():
+            x = torch.randn(4, 3, 8, 8)
+            y_t = torch.randn(4, 2)
+            for step in reversed(range(10)):
+                out = model(x, y_t, y_t, torch.tensor([step]))
+                assert out.shape == (4, 2)
+        assert len(calls) == 1
+
+    def test_compile(self, model: ConditionalGuidedConvModel) -> None:
+        compiled = ConditionalGuidedConvModel(
+            model.encoder, model.cond_guide_model, compile=True
+        )
+        x = torch.randn(4, 3, 8, 8)
+        y_t = torch.randn(4, 2)
+        t = torch.randint(0, 10, (4,))
+        model.eval()
+        compiled.eval()
+        torch.testing.assert_close(compiled(x, y_t, y_t, t), model(x, y_t, y_t, t))
+
+        # the copy runs with its own weights
+        compiled_copy = copy.deepcopy(compiled)
+        with torch.no_grad():
+            compiled_copy.cond_guide_model.model[-1].bias.add_(1.0)
+        torch.testing.assert_close(
+            compiled_copy(x, y_t, y_t, t), model(x, y_t, y_t, t) + 1.0
+        )
+
+    def test_encoder_cache_invalidation(
+        self, model: ConditionalGuidedConvModel
+    ) -> None:
+        model.eval()
+        x = torch.randn(4, 3, 8, 8)
+        with torch.no_grad():
+            cached = model.encode(x)
+            assert model.encode(x) is cached
+
+            model.encoder[3].weight.add_(1.0)
+            expected = model.norm(model.encoder(x))
+            features = model.encode(x)
+            torch.testing.assert_close(features, expected)
+            assert features is not cached
+
+            model.train()
+            assert model.encode(x) is not features
+
+    def test_fuse_bn_for_inference(self, model: ConditionalGuidedConvModel) -> None:
+        with pytest.raises(AssertionError):
+            model.fuse_bn_for_inference()
+
+        bn = model.connect_module[1]
+        bn.running_mean.normal_()
+        bn.running_var.uniform_(0.5, 2.0)
+        bn.weight.data.normal_()
+        bn.bias.data.normal_()
+        model.eval()
+
+        x = torch.randn(4, 2)
+        t = torch.tensor([3])
+        expected = model.connect_module(x, t)
+        model.fuse_bn_for_inference()
+        assert isinstance(model.connect_module[1], nn.Identity)
+        torch.testing.assert_close(model.connect_module(x, t), expected)
+        with torch.no_grad():
+            torch.testing.assert_close(model.connect_module(x, t), expected)
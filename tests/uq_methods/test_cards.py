@@ -0,0 +1,95 @@
+# Copyright (c) 2023 lightning-uq-box. All rights reserved.
+# Licensed under the Apache License 2.0.
+
+"""Test CARD Noise Scheduler."""
+
+import math
+
+import pytest
+import torch
+
+from lightning_uq_box.uq_methods import NoiseScheduler
+
+
+class TestNoiseScheduler:
+    @pytest.mark.parametrize("n_steps", [5, 1000])
+    def test_sigmoid_schedule(self, n_steps: int) -> None:
+        beta_start, beta_end = 1e-5, 1e-2
+        scheduler = NoiseScheduler("sigmoid", n_steps, beta_start, beta_end)
+        betas = scheduler.betas
+        assert betas.shape == (n_steps,)
+        assert torch.isclose(betas[0], torch.tensor(beta_start), atol=1e-4)
+        assert torch.isclose(betas[-1], torch.tensor(beta_end), atol=1e-4)
+        assert torch.all(betas[1:] >= betas[:-1])
+
+    @pytest.mark.parametrize(
+        "schedule", ["linear", "const", "quad", "sigmoid", "cosine", "cosine_anneal"]
+    )
+    @pytest.mark.parametrize("dtype", [torch.float32, torch.float64])
+    def test_schedule_dtype(self, schedule: str, dtype: torch.dtype) -> None:
+        scheduler = NoiseScheduler(schedule, n_steps=10, device="cpu", dtype=dtype)
+        assert scheduler.betas.shape == (10,)
+        assert scheduler.betas.dtype == dtype
+        assert scheduler.alphas_bar_sqrt.dtype == dtype
+
+    @pytest.mark.parametrize(
+        "schedule", ["linear", "const", "quad", "sigmoid", "cosine", "cosine_anneal"]
+    )
+    def test_alphas_cumprod(self, schedule: str) -> None:
+        scheduler = NoiseScheduler(schedule, n_steps=1000)
+        torch.testing.assert_close(
+            scheduler.alphas_cumprod, scheduler.alphas.cumprod(dim=0)
+        )
+
+    def test_buffers(self) -> None:
+        scheduler = NoiseScheduler("linear", n_steps=10)
+        buffers = dict(scheduler.named_buffers())
+        assert "alphas_bar_sqrt" in buffers
+        assert "one_minus_alphas_bar_sqrt" in buffers
+        # derived from the hyperparameters, so not part of checkpoints
+        assert len(scheduler.state_dict()) == 0
+
+    @pytest.mark.parametrize("dtype", [torch.bfloat16, torch.float16, torch.float64])
+    def test_buffers_keep_dtype(self, dtype: torch.dtype) -> None:
+        scheduler = NoiseScheduler("linear", n_steps=1000)
+        alphas = scheduler.alphas.clone()
+        scheduler = scheduler.to(dtype)
+        assert scheduler.alphas.dtype == torch.float32
+        torch.testing.assert_close(scheduler.alphas, alphas)
+        scheduler.half()
+        assert scheduler.one_minus_alphas_bar_sqrt.dtype == torch.float32
+
+    @pytest.mark.parametrize("n_steps", [5, 1000])
+    def test_cosine_schedules(self, n_steps: int) -> None:
+        beta_start, beta_end = 1e-5, 1e-2
+        expected = [
+            min(
+                1
+                - math.cos(((i + 1) / n_steps + 0.008) / 1.008 * math.pi / 2) ** 2
+                / math.cos((i / n_steps + 0.008) / 1.008 * math.pi / 2) ** 2,
+                0.999,
+            )
+            for i in range(n_steps)
+        ]
+        scheduler = NoiseScheduler("cosine", n_steps, beta_start, beta_end)
+        torch.testing.assert_close(scheduler.betas, torch.tensor(expected))
+
+        expected = [
+            beta_start
+            + 0.5
+            * (beta_end - beta_start)
+            * (1 - math.cos(t / (n_steps - 1) * math.pi))
+            for t in range(n_steps)
+        ]
+        scheduler = NoiseScheduler("cosine_anneal", n_steps, beta_start, beta_end)
+        torch.testing.assert_close(scheduler.betas, torch.tensor(expected))
+
+    @pytest.mark.parametrize("x_shape", [(4, 1), (4, 3, 8, 8)])
+    def test_get_noisy_x_at_t(self, x_shape: tuple[int, ...]) -> None:
+        scheduler = NoiseScheduler("linear", n_steps=10)
+        t = torch.tensor([0, 3, 9, 3])
+        out = NoiseScheduler.get_noisy_x_at_t(
+            scheduler.alphas_bar_sqrt, t, torch.randn(x_shape)
+        )
+        assert out.shape == (4,) + (1,) * (len(x_shape) - 1)
+        torch.testing.assert_close(out.flatten(), scheduler.alphas_bar_sqrt[t])